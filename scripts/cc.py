@@ -23,19 +23,59 @@
 
 import argparse
 import json
+import os
+import shlex
 from pathlib import Path
 
+# orjson parses and pretty-prints large compile_commands.json files much
+# faster than the json module, but it is optional.
+try:
+    import orjson
+
+    def load_json(fd):
+        return orjson.loads(fd.read())
+
+    def dump_json(data, fd):
+        fd.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+except ImportError:
+    def load_json(fd):
+        return json.load(fd)
+
+    def dump_json(data, fd):
+        fd.write(json.dumps(data, indent=2,
+                            ensure_ascii=False).encode('UTF-8'))
+
 
 def find_compile_commands(fname: str) -> Path:
     curdir = Path.cwd()
-    ccpath = curdir
-
-    ccfile = ccpath.joinpath(fname)
-    while not ccfile.exists() and not ccpath.joinpath('.git').exists():
-        ccpath = ccpath.parent
+    parts = Path(fname).parts
+    # The listing only helps when fname starts with a plain name that can
+    # appear in it; '.', '..' and absolute paths always need a stat().
+    top = parts[0] if parts and parts[0] != '..' and \
+        not Path(fname).is_absolute() else None
+
+    # Read each directory once on the way up to the root, rather than
+    # stat()'ing both candidates at every level.
+    for ccpath in [curdir, *curdir.parents]:
         ccfile = ccpath.joinpath(fname)
+        try:
+            with os.scandir(ccpath) as it:
+                entries = {e.name for e in it}
+        except OSError:
+            # Unreadable (but possibly searchable) directory: stat instead.
+            if ccfile.exists() or ccpath.joinpath('.git').exists():
+                return ccfile
+            continue
 
-    return ccfile
+        if top is None:
+            found = ccfile.exists()
+        else:
+            found = top in entries and (top == fname or ccfile.exists())
+        if found or '.git' in entries:
+            return ccfile
+
+    return curdir.joinpath(fname)
 
 
 def parse_args():
@@ -62,23 +102,26 @@ def main():
 
     ccfile = find_compile_commands(args.jsonfile)
 
-    with open(ccfile, 'r', encoding='UTF-8') as fd:
-        data = json.load(fd)
+    with open(ccfile, 'rb') as fd:
+        data = load_json(fd)
 
     for elem in data:
         path = Path(elem['directory'])
         if path.name in ['googlemock', 'googletest']:
             continue
 
-        cmd = elem['command']
-        index = cmd.find('-I')
-
-        cmd = cmd[:index] + ' '.join(incs) + ' ' + cmd[index:]
+        argv = elem.get('arguments')
+        if argv is None:
+            argv = shlex.split(elem.pop('command'))
+            elem['arguments'] = argv
 
-        elem['command'] = cmd
+        # Put incs ahead of the first include directory, or right after
+        # the compiler when there is none.
+        index = next((i for i, a in enumerate(argv) if a.startswith('-I')), 1)
+        argv[index:index] = incs
 
-    with open(ccfile, 'w', encoding='UTF-8') as fd:
-        json.dump(data, fd, indent=2)
+    with open(ccfile, 'wb') as fd:
+        dump_json(data, fd)
 
 if __name__ == '__main__':
     main()
@@ -26,9 +26,13 @@ This script generates the keyword portion of the C lexer.
 """
 
 import argparse
+import hashlib
+import os
+import pickle
 import sys
-from collections import defaultdict
-from typing import Dict, Set, Tuple
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 keys = [
     'alignas',
@@ -158,20 +162,63 @@ tknfor = {}
 for i, k in enumerate(keys):
     tknfor[k] = tokens[i]
 
-def substrings(s: str):
+TOKEN_LEN = {k: (tknfor[k], len(k)) for k in keys}
+
+# The number of keywords that begin with each prefix, used by hit_order().
+LIVE = Counter(k[:i] for k in keys for i in range(1, len(k) + 1))
+
+# Templates for the cases emitted by generate_source(), see find_collisions().
+CASE1 = '''\
+      if (is_ident_cont(sr_->peek())) {{
+        nextst(GOT_IDENT);
+      }} else {{
+        r(Token::{0}, {1});
+      }}'''
+
+CASE2 = '''\
+      if (sr_->peek() == '{0}') {{
+        nextst(GOT_{1});
+      }} else if (is_ident_cont(sr_->peek())) {{
+        nextst(GOT_IDENT);
+      }} else {{
+        r(Token::{2}, {3});
+      }}'''
+
+CASE3 = '      nextst(GOT_{0});'
+
+# The c_lex_accept[] and c_lex_ac_out[] entries emitted by generate_table()
+# and generate_ac().
+ACCEPT = 'C_LEX_A(Token::{0}, {1})'
+
+# The (size, type, literal suffix) of the words used by swar_compare().
+SWAR_WORDS = [
+    (8, 'std::uint64_t', 'ULL'),
+    (4, 'std::uint32_t', 'U'),
+    (2, 'std::uint16_t', 'U'),
+    (1, 'std::uint8_t', 'U'),
+]
+
+# Candidate multipliers for the perfect hash string functions.
+PH_MULTIPLIERS = [31, 33, 37, 41, 43, 47, 53, 59,
+                  61, 67, 71, 73, 79, 83, 89, 97]
+
+def build_trie(keys: List[str]) -> Dict:
     """
-    For a given keyword string, eg 'while', produce all the incrementing
-    substrings up to, but not including, the last character.
+    Build a prefix trie over the keywords. Each node maps the next
+    character to its child node, and the node for a complete keyword
+    also maps '$' to that keyword, eg for 'do' and 'double':
 
-    w
-    wh
-    whi
-    whil
+    {'d': {'o': {'$': 'do', 'u': {'b': {'l': {'e': {'$': 'double'}}}}}}}
     """
-    for i in range(1, len(s) + 1):
-        yield s[:i]
+    trie = {}
+    for k in keys:
+        node = trie
+        for ch in k:
+            node = node.setdefault(ch, {})
+        node['$'] = k
+    return trie
 
-def find_collisions(key: str, data: Dict, already: Set, collisions: Dict):
+def find_collisions(trie: Dict, data: Dict, collisions: Dict):
     """
     For C'23, four pairs of keywords collide with each other with respect
     to scanning:
@@ -244,91 +291,788 @@ def find_collisions(key: str, data: Dict, already: Set, collisions: Dict):
 
     """
 
-    for s in substrings(key):
-        if s in already:
-            continue
-        already.add(s)
+    stack = [('', trie)]
+    while stack:
+        s, node = stack.pop()
 
-        for k in keys:
-            if k != s and k.find(s) == 0:
-                fragment = k[:len(s)+1]
+        for ch in sorted(node):
+            if ch == '$':
+                continue
+            nxt = s + ch
+            child = node[ch]
+            stack.append((nxt, child))
 
-                if fragment in keys:
-                    fragment = '*' + fragment
+            fragment = nxt
+            if '$' in child:
+                if len(child) > 1:
+                    # nxt is a keyword and also a prefix of another one.
+                    fragment = '!' + nxt
+                    collisions[nxt] = max(d for d in child if d != '$')
+                else:
+                    fragment = '*' + nxt
 
-                if fragment not in data[s]:
-                    data[s].append(fragment)
+            # The first character is handled by the START state.
+            if s:
+                data[s].add(fragment)
 
-    for k in keys:
-        if k in data:
-            fragment = '*' + k # change the * to a !
-            index = k[:-1]
-            if fragment in data[index]:
-                data[index].remove(fragment)
-                data[index].append('!' + k)
 
-                # Find our next character to match.
-                for d in data[k]:
-                    collisions[k] = d[-1:]
+def successors(data: Dict, i: str) -> List[str]:
+    """
+    The entries of data[i], ordered by the character that they match.
+    """
+    return sorted(data[i], key=lambda nxt: nxt[-1])
+
+
+def by_frequency(data: Dict, i: str) -> List[str]:
+    """
+    The entries of data[i], ordered by the number of keywords still live
+    through each of them, most first.
+    """
+    return sorted(data[i], key=lambda nxt: (-LIVE[nxt.lstrip('*!')], nxt[-1]))
+
+
+def hit_order(data: Dict) -> List[str]:
+    """
+    Order the GOT_* states for emission by a breadth-first walk
+    from START, visiting the busiest states first at each level. The
+    first characters come first, with '_' (14 keywords) and 's' (7) well
+    ahead of 'n' or 'w' (1 each), then the second characters, and so on,
+    so the states that are hit most often are laid out together.
+    """
+    roots = sorted({k[0] for k in keys}, key=lambda s: (-LIVE[s], s))
+    order = []
+    seen = set()
+    queue = deque(roots)
+
+    while queue:
+        i = queue.popleft()
+        if i in seen or i not in data:
+            continue
+        seen.add(i)
+
+        order.append(i)
+        for nxt in by_frequency(data, i):
+            queue.append(nxt.lstrip('*!'))
 
+    assert len(order) == len(data)
+    return order
 
-def generate_defines(start: int, data: Dict):
+
+def state_ids(start: int, data: Dict) -> Dict:
+    """
+    Assign each GOT_* state a contiguous integer, beginning at start.
+    """
+    ids = {}
     for i in sorted(data.keys()):
-        print(f'#define GOT_{i} {start}')
+        ids[i] = start
         start += 1
+    return ids
 
 
-def generate_case_1(nxt: str):
-    print('      if (is_ident_cont(sr_->peek())) {')
-    print('        nextst(GOT_IDENT);')
-    print('      } else {')
-    print(f'        r(Token::{tknfor[nxt]}, {len(nxt)});')
-    print('      }')
+def generate_defines(out: List[str], start: int, data: Dict):
+    for i, n in state_ids(start, data).items():
+        out.append(f'#define GOT_{i} {n}')
 
 
-def generate_case_2(collisions: Dict, nxt: str):
-    print(f"      if (sr_->peek() == '{collisions[nxt]}') {{")
-    print(f'        nextst(GOT_{nxt});')
-    print('      } else if (is_ident_cont(sr_->peek())) {')
-    print('        nextst(GOT_IDENT);')
-    print('      } else {')
-    print(f'        r(Token::{tknfor[nxt]}, {len(nxt)});')
-    print('      }')
+def generate_case_1(out: List[str], nxt: str):
+    out.append(CASE1.format(*TOKEN_LEN[nxt]))
 
 
-def generate_case_3(nxt: str):
-    print(f'      nextst(GOT_{nxt});')
+def generate_case_2(out: List[str], collisions: Dict, nxt: str):
+    out.append(CASE2.format(collisions[nxt], nxt, *TOKEN_LEN[nxt]))
 
 
-def generate_source(data: Dict, collisions: Dict):
-    for i in sorted(data.keys()):
+def generate_case_3(out: List[str], nxt: str):
+    out.append(CASE3.format(nxt))
+
+
+def generate_state(out: List[str], data: Dict, collisions: Dict, i: str):
+    out.append('  switch (c) {')
+
+    for nxt in by_frequency(data, i):
+        special = nxt[0]
+        if special in {'*', '!'}:
+            nxt = nxt[1:]
+
+        out.append(f"    case '{nxt[-1]}':")
+
+        if special == '*':
+            generate_case_1(out, nxt)
+        elif special == '!':
+            generate_case_2(out, collisions, nxt)
+        else:
+            generate_case_3(out, nxt)
+
+        out.append('      break;')
+
+
+    out.append('    default:')
+    out.append('      holdst(GOT_IDENT);')
+    out.append('      break;')
+    out.append(f'}} // switch (c) for GOT_{i}')
 
-        print(f'case GOT_{i}:')
-        print('  switch (c) {')
 
-        for nxt in data[i]:
+def emit_macro(out: List[str], lines: List[str]):
+    """
+    Emit a multi-line #define, with the continuations in column 80.
+    """
+    for line in lines[:-1]:
+        out.append(f'{line:<79}\\')
+    out.append(lines[-1])
+
+
+def generate_threaded(out: List[str], data: Dict, collisions: Dict):
+    """
+    Emit the keyword states as a threaded dispatcher using the GNU
+    computed goto extension. Each state becomes a label rather than a
+    case of switch (st), and when a state moves on to another keyword
+    state it fetches the next character itself and jumps straight to
+    that state's label:
+
+    case GOT__ ... GOT_whil: {
+      static const void *const c_lex_jt[] = {&&L_GOT__, ...};
+      goto *c_lex_jt[st - GOT__];
+
+    L_GOT__:
+      switch (c) {
+      ...
+      } // switch (c) for GOT__
+      c_lex_dispatch();
+      break;
+    ...
+    }
+
+    Anything else (holdst(), GOT_IDENT, returning a token) leaves the
+    dispatcher through the main loop as before. This relies on the
+    GOT_* values being contiguous and in sorted order, as emitted by
+    generate_defines().
+    """
+    states = sorted(data.keys())
+    first = f'GOT_{states[0]}'
+    last = f'GOT_{states[-1]}'
+
+    out.append(f'case {first} ... {last}: {{')
+    out.append('  static const void *const c_lex_jt[] = {')
+    for i in states:
+        out.append(f'      &&L_GOT_{i},')
+    out.append('  };')
+    out.append('')
+
+    emit_macro(out, [
+        '#define c_lex_dispatch()',
+        '  do {',
+        f'    if (!_hold && st >= {first} && st <= {last}) {{',
+        '      c = sr_->eof() ? EOF : sr_->get();',
+        '      if (c != EOF)',
+        '        lex.push_back(c);',
+        f'      goto *c_lex_jt[st - {first}];',
+        '    }',
+        '  } while (0)',
+    ])
+    out.append('')
+
+    out.append(f'  goto *c_lex_jt[st - {first}];')
+    out.append('')
+
+    for i in hit_order(data):
+        out.append(f'L_GOT_{i}:')
+        generate_state(out, data, collisions, i)
+        out.append('c_lex_dispatch();')
+        out.append('break;')
+        out.append('')
+
+    out.append('}')
+    out.append('#undef c_lex_dispatch')
+
+
+def generate_source(out: List[str], data: Dict, collisions: Dict,
+                    threaded: bool = False):
+    if threaded:
+        out.append('#ifdef __GNUC__')
+        generate_threaded(out, data, collisions)
+        out.append('#else')
+
+    for i in hit_order(data):
+
+        out.append(f'case GOT_{i}:')
+        generate_state(out, data, collisions, i)
+        out.append('break;')
+        out.append('')
+
+    if threaded:
+        out.append('#endif // __GNUC__')
+
+
+def emit_array(out: List[str], values: List, indent: str = '    ',
+               per_line: int = 16):
+    for i in range(0, len(values), per_line):
+        line = ', '.join(str(v) for v in values[i:i+per_line])
+        out.append(f'{indent}{line},')
+
+
+def generate_ident_case(out: List[str], classify: str):
+    """
+    Emit the GOT_IDENT case for the backends that classify the whole
+    identifier once it has been scanned.
+    """
+    out.append('case GOT_IDENT:')
+    out.append('  if (is_ident_cont(c)) {')
+    out.append('    // Eat c and remain in this state.')
+    out.append('  } else {')
+    out.append('    backup(c);')
+    out.append(f'    r({classify}(lex.data(), lex.length()), lex.length());')
+    out.append('  }')
+    out.append('  break;')
+
+
+def generate_accept_macro(out: List[str], table: str):
+    """
+    Emit C_LEX_A(), which packs (token << 8) | length into the uint16_t
+    entries of table, as spelled by ACCEPT, along with a check that every
+    token fits in the upper 8 bits.
+    """
+    out.append('#define C_LEX_A(_tkn, _len)                                  '
+               '                  \\')
+    out.append('  static_cast<std::uint16_t>((static_cast<unsigned>(_tkn) '
+               '<< 8) | (_len))')
+    out.append('')
+
+    out.append('static_assert(static_cast<unsigned>(Token::INVALID) < 256,')
+    out.append(f'              "{table}[] packs tokens in 8 bits");')
+    out.append('')
+
+
+def generate_table(out: List[str], data: Dict, collisions: Dict):
+    """
+    Emit the keyword state machine as a flat DFA transition table, so
+    that the hot loop of the keyword scanner becomes
+
+      st = c_lex_trans[st][c];
+
+    State 0 (C_LEX_IDENT) is the plain identifier state, and the GOT_*
+    states follow in the order given by state_ids(). The first character
+    of the identifier doesn't go through the table; it selects the
+    initial state with a single load from c_lex_first[256].
+
+    The transition that consumes the last character of a keyword (a '*'
+    entry of data) is the C_LEX_ACCEPT sentinel, and c_lex_accept[st]
+    holds (token << 8) | length for the keyword completed from st.
+
+    Keywords that end in a '*' entry rarely need a state of their own, so
+    the machine fits in state numbers 0..254 and c_lex_trans[] is stored
+    as uint8_t, with 255 as the sentinel. That halves the table, to about
+    62 KB, leaving more of it in cache for the scanner's hot loop.
+
+    A colliding keyword (a '!' entry of data, eg 'const') is a real state
+    instead, since the longer keyword continues from it, and its own
+    c_lex_accept[] entry holds its token. The stored length tells the two
+    uses apart, so no peek() is needed at runtime:
+
+    'cons'  + 't' -> GOT_const, accept CONST/5, 'const' matches
+    'const' + 'e' -> GOT_conste, accept 0
+
+    Since c_lex_accept[] has one entry per state, the sentinel can only
+    stand for a keyword when it is the sole '*' entry of a state that
+    accepts nothing itself. Otherwise (eg 'ab' and 'ac' both ending from
+    GOT_a, or 'abc' ending from the colliding GOT_ab) each such keyword
+    gets an extra state, numbered after the GOT_* states and with no
+    transitions out of it, whose c_lex_accept[] entry holds its token.
+    No keyword in this repo's list needs one.
+    """
+    ids = state_ids(1, data)
+    states = sorted(data.keys())
+
+    # The states whose own c_lex_accept[] entry is taken by a colliding
+    # keyword, and the '*' keywords completed from each state.
+    claimed = {ids[k] for k in collisions}
+    ends = {}
+    for i in states:
+        ends[ids[i]] = [nxt[1:] for nxt in successors(data, i)
+                        if nxt[0] == '*']
+
+    extra = {}
+    for n, ks in ends.items():
+        if len(ks) > 1 or (ks and n in claimed):
+            for k in ks:
+                extra[k] = len(states) + 1 + len(extra)
+
+    nstates = len(states) + 1 + len(extra)
+    assert nstates <= 0xff, 'too many states for a uint8_t table'
+
+    first = [0] * 256
+    trans = [[0] * 256 for _ in range(nstates)]
+    accept = ['0'] * nstates
+
+    for k in keys:
+        first[ord(k[0])] = ids[k[0]]
+
+    for i in states:
+        n = ids[i]
+        for nxt in successors(data, i):
             special = nxt[0]
             if special in {'*', '!'}:
                 nxt = nxt[1:]
 
-            print(f"    case '{nxt[-1]}':")
-
-            if special == '*':
-                generate_case_1(nxt)
+            if special == '*' and nxt in extra:
+                trans[n][ord(nxt[-1])] = extra[nxt]
+                accept[extra[nxt]] = ACCEPT.format(*TOKEN_LEN[nxt])
+            elif special == '*':
+                trans[n][ord(nxt[-1])] = 'C_LEX_ACCEPT'
+                accept[n] = ACCEPT.format(*TOKEN_LEN[nxt])
             elif special == '!':
-                generate_case_2(collisions, nxt)
+                trans[n][ord(nxt[-1])] = ids[nxt]
+                accept[ids[nxt]] = ACCEPT.format(*TOKEN_LEN[nxt])
             else:
-                generate_case_3(nxt)
+                trans[n][ord(nxt[-1])] = ids[nxt]
+
+    names = (['C_LEX_IDENT'] + [f'GOT_{i}' for i in states] +
+             [f'GOT_{k}' for k in extra])
+
+    out.append('#define C_LEX_IDENT 0')
+    out.append(f'#define C_LEX_STATES {nstates}')
+    out.append('#define C_LEX_ACCEPT 0xff')
+    generate_accept_macro(out, 'c_lex_accept')
+
+    out.append('static const std::uint8_t c_lex_first[256] = {')
+    emit_array(out, first)
+    out.append('};')
+    out.append('')
+
+    out.append('static const std::uint8_t c_lex_trans[C_LEX_STATES][256] = {')
+    for n, row in enumerate(trans):
+        out.append(f'    // {names[n]}')
+        out.append('    {')
+        emit_array(out, row, indent='        ')
+        out.append('    },')
+    out.append('};')
+    out.append('')
+
+    out.append('static const std::uint16_t c_lex_accept[C_LEX_STATES] = {')
+    for n, a in enumerate(accept):
+        out.append(f'    {a}, // {names[n]}')
+    out.append('};')
+    out.append('')
+
+    out.append('inline Token c_lex_classify(const char *s, std::size_t n) {')
+    out.append('  // s is a scanned identifier, so n >= 1.')
+    out.append('  std::uint8_t st = '
+               'c_lex_first[static_cast<unsigned char>(s[0])];')
+    out.append('  for (std::size_t i = 1; i < n; ++i) {')
+    out.append('    const std::uint8_t nxt =')
+    out.append('        c_lex_trans[st][static_cast<unsigned char>(s[i])];')
+    out.append('    if (nxt == C_LEX_ACCEPT) {')
+    out.append('      break;')
+    out.append('    }')
+    out.append('    st = nxt;')
+    out.append('  }')
+    out.append('  const std::uint16_t a = c_lex_accept[st];')
+    out.append('  return (a && (a & 0xff) == n) ? static_cast<Token>(a >> 8)')
+    out.append('                                : Token::IDENTIFIER;')
+    out.append('}')
+    out.append('')
+
+    generate_ident_case(out, 'c_lex_classify')
+
+
+def build_aho_corasick(keys: List[str]) -> Tuple:
+    """
+    Build an Aho-Corasick automaton over the keywords.
+
+    The goto function is the keyword trie, with states numbered in
+    breadth-first order from the root (state 0). The failure links are
+    then computed breadth-first and used to complete the goto function,
+    so that every state has a transition on every character and the
+    automaton can be emitted as a flat DFA.
+
+    Returns (delta, kw, depth) where delta[st] is the complete 256 entry
+    row for st, kw[st] is the keyword spelled by st (or None), and
+    depth[st] is the length of the path from the root to st.
+    """
+    trie = build_trie(keys)
+
+    nodes = [trie]
+    index = {id(trie): 0}
+    kw = [trie.get('$')]
+    depth = [0]
+    goto = [{}]
+
+    queue = deque([trie])
+    while queue:
+        node = queue.popleft()
+        st = index[id(node)]
+        for ch in sorted(node):
+            if ch == '$':
+                continue
+            child = node[ch]
+            index[id(child)] = len(nodes)
+            goto[st][ch] = len(nodes)
+            nodes.append(child)
+            kw.append(child.get('$'))
+            depth.append(depth[st] + 1)
+            goto.append({})
+            queue.append(child)
+
+    fail = [0] * len(nodes)
+    delta = [[0] * 256 for _ in nodes]
+
+    # States are numbered breadth-first, so the failure state of st, which
+    # is always shallower, has had its row completed before st's is.
+    for st in range(len(nodes)):
+        for ch, t in goto[st].items():
+            if st:
+                f = fail[st]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[t] = goto[f].get(ch, 0)
+
+        if st:
+            delta[st] = list(delta[fail[st]])
+        for ch, t in goto[st].items():
+            delta[st][ord(ch)] = t
+
+    return (delta, kw, depth)
+
+
+def generate_ac(out: List[str]):
+    """
+    Emit an Aho-Corasick recognizer for the keywords, see
+    build_aho_corasick(). The lexer scans the identifier in GOT_IDENT and
+    classifies it with one pass through the automaton:
+
+      st = 0;
+      for (i = 0; i < n; ++i)
+        st = c_lex_ac_goto[st][s[i]];
+
+    Because the goto function is completed with the failure links, the
+    final state is the longest keyword prefix that is a suffix of s, eg
+    'xint' ends in the state for 'int'. c_lex_ac_out[] therefore packs
+    (token << 8) | depth, and a keyword only matches when its depth is n,
+    ie when it spans the whole identifier. The failure links themselves
+    are only needed at build time and are not emitted.
+    """
+    delta, kw, depth = build_aho_corasick(keys)
+    nstates = len(delta)
+    assert nstates < 0x10000
+
+    out.append(f'#define C_LEX_AC_STATES {nstates}')
+    generate_accept_macro(out, 'c_lex_ac_out')
+
+    out.append('static const std::uint16_t '
+               'c_lex_ac_goto[C_LEX_AC_STATES][256] = {')
+    for st, row in enumerate(delta):
+        out.append(f'    // {st}: {kw[st] or ""} (depth {depth[st]})')
+        out.append('    {')
+        emit_array(out, row, indent='        ')
+        out.append('    },')
+    out.append('};')
+    out.append('')
+
+    out.append('static const std::uint16_t c_lex_ac_out[C_LEX_AC_STATES] = {')
+    for st, k in enumerate(kw):
+        if k is None:
+            out.append(f'    0, // {st}')
+        else:
+            out.append(f'    {ACCEPT.format(*TOKEN_LEN[k])}, // {st}: {k}')
+    out.append('};')
+    out.append('')
+
+    out.append('inline Token classify_ident(const char *s, std::size_t n) {')
+    out.append('  std::uint16_t st = 0;')
+    out.append('  for (std::size_t i = 0; i < n; ++i) {')
+    out.append('    st = c_lex_ac_goto[st][static_cast<unsigned char>(s[i])];')
+    out.append('  }')
+    out.append('  const std::uint16_t a = c_lex_ac_out[st];')
+    out.append('  return (a && (a & 0xff) == n) ? static_cast<Token>(a >> 8)')
+    out.append('                                : Token::IDENTIFIER;')
+    out.append('}')
+    out.append('')
+
+    generate_ident_case(out, 'classify_ident')
+
+
+def kw_hash(s: str, mult: int) -> int:
+    """
+    The polynomial string hash used by the perfect hash, computed with
+    the same 32-bit wrap-around as the generated C++ code.
+    """
+    h = 0
+    for ch in s:
+        h = (h * mult + ord(ch)) & 0xffffffff
+    return h
+
+
+def build_perfect_hash(keys: List[str], nslots: int, nbuckets: int) -> Tuple:
+    """
+    Build a two-level (hash and displace) perfect hash over keys, in
+    the style of NetBSD's nbperf.
+
+    Each key is placed in bucket kw_hash(k, P1) % nbuckets. Buckets are
+    then visited largest first, and each one is assigned the smallest
+    displacement d such that (kw_hash(k, P2) + d) % nslots lands every
+    key of the bucket in a free slot. The multipliers are searched until
+    a placement is found.
+
+    Returns (P1, P2, displacements, slots).
+    """
+    for p1 in PH_MULTIPLIERS:
+        for p2 in PH_MULTIPLIERS:
+            if p1 == p2:
+                continue
+
+            buckets = defaultdict(list)
+            for k in keys:
+                buckets[kw_hash(k, p1) % nbuckets].append(k)
+
+            disp = [0] * nbuckets
+            slots = [None] * nslots
+            ok = True
+
+            for b in sorted(buckets, key=lambda b: (-len(buckets[b]), b)):
+                h2 = [kw_hash(k, p2) for k in buckets[b]]
+                for d in range(nslots):
+                    pos = {(h + d) % nslots for h in h2}
+                    if len(pos) == len(h2) and \
+                       all(slots[p] is None for p in pos):
+                        break
+                else:
+                    ok = False
+                    break
+
+                disp[b] = d
+                for k, h in zip(buckets[b], h2):
+                    slots[(h + d) % nslots] = k
+
+            if ok:
+                return (p1, p2, disp, slots)
+
+    raise RuntimeError('no perfect hash found, increase the table size')
+
+
+def swar_compare(k: str) -> List[str]:
+    """
+    Produce the word compares that match keyword k against s, given that
+    n == len(k) has already been checked against keyword_table.
+
+    The keyword is covered by the widest word that fits, loaded from the
+    front and, when the keyword is not exactly one word long, again from
+    the back of s. The two loads may overlap but never read past s[n-1],
+    eg for 'alignas' (7 bytes) the two 4-byte loads cover 'alig' and 'gnas':
+
+    kw_load<std::uint32_t>(s) == 0x67696C61U
+    kw_load<std::uint32_t>(s + 3) == 0x73616E67U
+
+    The constants are computed for a little-endian target.
+    """
+    n = len(k)
+    if n > 16:
+        return ['!std::memcmp(s, e.s, n)']
+
+    width, ctype, suffix = next(w for w in SWAR_WORDS if n >= w[0])
+
+    compares = []
+    for off in sorted({0, n - width}):
+        value = int.from_bytes(k[off:off+width].encode(), 'little')
+        addr = f's + {off}' if off else 's'
+        compares.append(f'kw_load<{ctype}>({addr}) == '
+                        f'0x{value:0{2*width}X}{suffix}')
+    return compares
+
+
+def emit_perfect_hash(out: List[str], keys: List[str], tokens: List[str]):
+    """
+    Emit a perfect hash keyword recognizer.
 
-            print('      break;')
+    Rather than walking the GOT_* keyword states one character at a
+    time, the lexer scans the whole identifier in GOT_IDENT and then
+    classifies it with a single hash() probe. Identifiers longer than
+    KW_MAXLEN are rejected before hashing, and keyword_table stores the
+    length of the keyword in each slot so that most other identifiers are
+    rejected with one integer compare. What remains is a case of
+    keyword_lookup() that confirms its keyword with one or two word
+    compares (see swar_compare()) instead of a byte-wise memcmp():
 
+    static const std::uint8_t kw_disp[KW_HASH_BUCKETS] = { ... };
 
-        print('    default:')
-        print('      holdst(GOT_IDENT);')
-        print('      break;')
-        print(f'}} // switch (c) for GOT_{i}')
-        print('break;')
-        print()
+    static const keyword_entry keyword_table[KW_HASH_SLOTS] = {
+      ...
+      {7, Token::ALIGNAS, "alignas"},
+      ...
+    };
+
+    inline std::size_t hash(const char *s, std::size_t n) { ... }
+
+    inline Token keyword_lookup(const char *s, std::size_t n) {
+      if (n > KW_MAXLEN) {
+        return Token::IDENTIFIER;
+      }
+      const std::size_t h = hash(s, n);
+      const keyword_entry &e = keyword_table[h];
+      if (e.len != n) {
+        return Token::IDENTIFIER;
+      }
+      switch (h) {
+      ...
+      case 39: // alignas
+        if (kw_load<std::uint32_t>(s) == 0x67696C61U &&
+            kw_load<std::uint32_t>(s + 3) == 0x73616E67U) {
+          return e.tkn;
+        }
+        break;
+      ...
+      }
+      return Token::IDENTIFIER;
+    }
+
+    followed by the GOT_IDENT case that calls keyword_lookup().
+    """
+    nslots = 1
+    while nslots < len(keys):
+        nslots <<= 1
+    nbuckets = nslots // 2
+
+    p1, p2, disp, slots = build_perfect_hash(keys, nslots, nbuckets)
+    tkn = dict(zip(keys, tokens))
+
+    out.append(f'#define KW_HASH_BUCKETS {nbuckets}')
+    out.append(f'#define KW_HASH_SLOTS {nslots}')
+    out.append(f'#define KW_MAXLEN {max(len(k) for k in keys)}')
+    out.append('')
+
+    out.append('#if defined(__BYTE_ORDER__) && '
+               '__BYTE_ORDER__ != __ORDER_LITTLE_ENDIAN__')
+    out.append('#error "keyword_lookup() assumes a little-endian target"')
+    out.append('#endif')
+    out.append('')
+
+    out.append('static const std::uint8_t kw_disp[KW_HASH_BUCKETS] = {')
+    emit_array(out, disp)
+    out.append('};')
+    out.append('')
+
+    out.append('struct keyword_entry {')
+    out.append('  std::uint8_t len;')
+    out.append('  Token tkn;')
+    out.append('  const char *s;')
+    out.append('};')
+    out.append('')
+
+    out.append('static const keyword_entry keyword_table[KW_HASH_SLOTS] = {')
+    for k in slots:
+        if k is None:
+            out.append('    {0, Token::IDENTIFIER, ""},')
+        else:
+            out.append(f'    {{{len(k)}, Token::{tkn[k]}, "{k}"}},')
+    out.append('};')
+    out.append('')
+
+    out.append('inline std::size_t hash(const char *s, std::size_t n) {')
+    out.append('  std::uint32_t h1 = 0;')
+    out.append('  std::uint32_t h2 = 0;')
+    out.append('  for (std::size_t i = 0; i < n; ++i) {')
+    out.append('    const unsigned char c = static_cast<unsigned char>(s[i]);')
+    out.append(f'    h1 = h1 * {p1}u + c;')
+    out.append(f'    h2 = h2 * {p2}u + c;')
+    out.append('  }')
+    out.append('  return (h2 + kw_disp[h1 % KW_HASH_BUCKETS]) % KW_HASH_SLOTS;')
+    out.append('}')
+    out.append('')
+
+    out.append('template <typename T> inline T kw_load(const char *s) {')
+    out.append('  T v;')
+    out.append('  std::memcpy(&v, s, sizeof(v));')
+    out.append('  return v;')
+    out.append('}')
+    out.append('')
+
+    out.append('inline Token keyword_lookup(const char *s, std::size_t n) {')
+    out.append('  if (n > KW_MAXLEN) {')
+    out.append('    return Token::IDENTIFIER;')
+    out.append('  }')
+    out.append('  const std::size_t h = hash(s, n);')
+    out.append('  const keyword_entry &e = keyword_table[h];')
+    out.append('  if (e.len != n) {')
+    out.append('    return Token::IDENTIFIER;')
+    out.append('  }')
+    out.append('  switch (h) {')
+    for h, k in enumerate(slots):
+        if k is None:
+            continue
+        cond = ' &&\n        '.join(swar_compare(k))
+        out.append(f'  case {h}: // {k}')
+        out.append(f'    if ({cond}) {{')
+        out.append('      return e.tkn;')
+        out.append('    }')
+        out.append('    break;')
+    out.append('  }')
+    out.append('  return Token::IDENTIFIER;')
+    out.append('}')
+    out.append('')
+
+    generate_ident_case(out, 'keyword_lookup')
+
+
+def _cache_key() -> str:
+    """
+    Hash the keyword list, along with this script so that changes to the
+    state construction also invalidate the cache.
+    """
+    h = hashlib.blake2b()
+    h.update('\0'.join(keys + tokens).encode())
+    h.update(Path(__file__).read_bytes())
+    return h.hexdigest()
+
+
+def cache_path() -> Optional[Path]:
+    """
+    Locate the cache file, or return None when there is no cache directory
+    (eg no HOME and no passwd entry in a sandboxed build).
+    """
+    # Per the XDG spec, an empty or relative XDG_CACHE_HOME is ignored.
+    cache = Path(os.environ.get('XDG_CACHE_HOME') or '')
+    if not cache.is_absolute():
+        try:
+            cache = Path.home() / '.cache'
+        except RuntimeError:
+            return None
+    return cache / 'c_lexer' / 'kwcache.pickle'
+
+
+def build_states(use_cache: bool = True) -> Tuple:
+    """
+    Compute (data, collisions), reusing the result of a previous
+    run from cache_path() when the keywords haven't changed. The cache is
+    best effort: any problem locating, reading or writing it just means
+    the states are computed again. use_cache=False skips it entirely.
+    """
+    path = cache_path() if use_cache else None
+
+    if path is not None:
+        key = _cache_key()
+        try:
+            with open(path, 'rb') as fd:
+                cached_key, states = pickle.load(fd)
+            if cached_key == key:
+                return states
+        except Exception:
+            pass
+
+    data = defaultdict(set)
+    collisions = {}
+
+    find_collisions(build_trie(keys), data, collisions)
+    states = (data, collisions)
+
+    if path is not None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp, 'wb') as fd:
+                pickle.dump((key, states), fd)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    return states
 
 
 def parse_args() -> Tuple:
@@ -337,6 +1081,9 @@ def parse_args() -> Tuple:
     parser.add_argument('-v', '--version', action='version',
                         version='%(prog)s 0.0.1',
                         help='display version information and exit')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='compute the keyword states without reading '
+                        'or writing the cache')
 
     subparser = parser.add_subparsers(dest='which')
 
@@ -344,26 +1091,41 @@ def parse_args() -> Tuple:
     defines.add_argument('-s', '--start', type=int, default=3,
                          help='The start value for the first #define.')
 
-    subparser.add_parser('code')
+    code = subparser.add_parser('code')
+    code.add_argument('-t', '--threaded', action='store_true',
+                      help='Emit a computed goto dispatcher for GCC/Clang.')
     subparser.add_parser('tests')
+    subparser.add_parser('perfhash')
+    subparser.add_parser('table')
+    subparser.add_parser('acgen')
+
+    all_ = subparser.add_parser('all',
+                                help='Write defines, code and tests to '
+                                'OUTDIR in a single run.')
+    all_.add_argument('outdir', type=Path,
+                      help='The directory to write the files to.')
+    all_.add_argument('-s', '--start', type=int, default=3,
+                      help='The start value for the first #define.')
+    all_.add_argument('-t', '--threaded', action='store_true',
+                      help='Emit a computed goto dispatcher for GCC/Clang.')
 
     return (parser, parser.parse_args())
 
 
-def generate_tests(data: Dict):
+def generate_tests(out: List[str], data: Dict):
     for key in sorted(data.keys()):
-        print(f'"{key}z", ')
+        out.append(f'"{key}z", ')
     for key in keys:
-        print(f'"{key}z", ')
+        out.append(f'"{key}z", ')
 
 
 def main():
-    data = defaultdict(list)
-    already = set()
-    collisions = {}
+    parser, args = parse_args()
+    if args.which is None:
+        parser.print_help()
+        sys.exit(1)
 
-    for k in keys:
-        find_collisions(k, data, already, collisions)
+    data, collisions = build_states(not args.no_cache)
 
     #print(f'collisions: {collisions}')
 
@@ -374,18 +1136,41 @@ def main():
     #for d in sorted(data):
     #    print(f'data[{d}] = {data[d]}')
 
-    parser, args = parse_args()
-    if args.which is None:
-        parser.print_help()
-        sys.exit(1)
+    out = []
 
     match args.which:
         case 'defines':
-            generate_defines(args.start, data)
+            generate_defines(out, args.start, data)
         case 'code':
-            generate_source(data, collisions)
+            generate_source(out, data, collisions, args.threaded)
         case 'tests':
-            generate_tests(data)
+            generate_tests(out, data)
+        case 'perfhash':
+            emit_perfect_hash(out, keys, tokens)
+        case 'table':
+            generate_table(out, data, collisions)
+        case 'acgen':
+            generate_ac(out)
+        case 'all':
+            outputs = {
+                'defines.h': [],
+                'code.inc': [],
+                'tests.inc': [],
+            }
+            generate_defines(outputs['defines.h'], args.start, data)
+            generate_source(outputs['code.inc'], data, collisions,
+                            args.threaded)
+            generate_tests(outputs['tests.inc'], data)
+
+            args.outdir.mkdir(parents=True, exist_ok=True)
+            for fname, lines in outputs.items():
+                lines.append('')
+                args.outdir.joinpath(fname).write_text('\n'.join(lines),
+                                                       encoding='UTF-8')
+            return
+
+    out.append('')
+    sys.stdout.write('\n'.join(out))
 
 if __name__ == '__main__':
     main()